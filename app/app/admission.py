@@ -0,0 +1,321 @@
+import asyncio
+import json
+import logging
+import os
+import re
+import time
+from collections import defaultdict
+from functools import lru_cache
+from fastapi import Depends, HTTPException, status
+from fastapi.responses import JSONResponse
+from starlette.datastructures import Headers
+from app.dependencies import oauth2_scheme, decode_token_login
+from app.config import get_settings
+
+logger = logging.getLogger(__name__)
+
+AUTH = "auth"
+TRANSFER = "transfer"
+METADATA = "metadata"
+
+
+def shed(status_code: int, detail: str):
+    return HTTPException(
+        status_code=status_code,
+        detail=detail,
+        headers={"Retry-After": str(get_settings().admission_retry_after)}
+    )
+
+
+class RouteClassLimiter:
+    """Concurrency limit with a short bounded wait queue for one class of routes."""
+
+    def __init__(self, name: str, max_concurrency: int, max_queue: int, queue_timeout: float):
+        self.name = name
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self.in_flight = 0
+        self.queued = 0
+        self.max_queued = 0
+        self.admitted = 0
+        self.shed_queue_full = 0
+        self.shed_timeout = 0
+
+    async def acquire(self):
+        if self._semaphore.locked():
+            if self.queued >= self.max_queue:
+                self.shed_queue_full += 1
+                raise shed(status.HTTP_503_SERVICE_UNAVAILABLE, "Server is busy, try again later")
+            self.queued += 1
+            self.max_queued = max(self.max_queued, self.queued)
+            try:
+                await asyncio.wait_for(self._semaphore.acquire(), self.queue_timeout)
+            except asyncio.TimeoutError:
+                self.shed_timeout += 1
+                raise shed(status.HTTP_503_SERVICE_UNAVAILABLE, "Server is busy, try again later")
+            finally:
+                self.queued -= 1
+        else:
+            await self._semaphore.acquire()
+        self.in_flight += 1
+        self.admitted += 1
+
+    def release(self):
+        self.in_flight -= 1
+        self._semaphore.release()
+
+    def stats(self) -> dict:
+        return {
+            "max_concurrency": self.max_concurrency,
+            "max_queue": self.max_queue,
+            "in_flight": self.in_flight,
+            "queued": self.queued,
+            "max_queued": self.max_queued,
+            "admitted": self.admitted,
+            "shed_queue_full": self.shed_queue_full,
+            "shed_timeout": self.shed_timeout,
+        }
+
+
+class UserInFlightLimiter:
+    """Caps the number of concurrent requests a single user can have in flight."""
+
+    def __init__(self, max_in_flight: int):
+        self.max_in_flight = max_in_flight
+        self._in_flight: dict[str, int] = defaultdict(int)
+        self.shed = 0
+
+    def acquire(self, login: str):
+        if self._in_flight[login] >= self.max_in_flight:
+            self.shed += 1
+            raise shed(status.HTTP_429_TOO_MANY_REQUESTS, "Too many concurrent requests")
+        self._in_flight[login] += 1
+
+    def release(self, login: str):
+        self._in_flight[login] -= 1
+        if self._in_flight[login] <= 0:
+            del self._in_flight[login]
+
+    def stats(self) -> dict:
+        return {
+            "max_in_flight": self.max_in_flight,
+            "active_users": len(self._in_flight),
+            "in_flight": sum(self._in_flight.values()),
+            "shed": self.shed,
+        }
+
+
+@lru_cache
+def get_route_limiters() -> dict[str, RouteClassLimiter]:
+    settings = get_settings()
+    return {
+        AUTH: RouteClassLimiter(
+            AUTH,
+            settings.auth_max_concurrency,
+            settings.auth_max_queue,
+            settings.admission_queue_timeout
+        ),
+        TRANSFER: RouteClassLimiter(
+            TRANSFER,
+            settings.transfer_max_concurrency,
+            settings.transfer_max_queue,
+            settings.admission_queue_timeout
+        ),
+        METADATA: RouteClassLimiter(
+            METADATA,
+            settings.metadata_max_concurrency,
+            settings.metadata_max_queue,
+            settings.admission_queue_timeout
+        ),
+    }
+
+
+@lru_cache
+def get_user_limiters() -> dict[str, UserInFlightLimiter]:
+    settings = get_settings()
+    return {
+        TRANSFER: UserInFlightLimiter(settings.transfer_user_max_in_flight),
+        METADATA: UserInFlightLimiter(settings.metadata_user_max_in_flight),
+    }
+
+
+def limit_route(route_class: str):
+    async def dependency():
+        limiter = get_route_limiters()[route_class]
+        await limiter.acquire()
+        try:
+            yield
+        finally:
+            limiter.release()
+
+    return dependency
+
+
+def limit_user_route(route_class: str):
+    # The user is taken from the token alone so that both slots are taken
+    # before the request checks out a database connection; get_current_user
+    # in the endpoint still does the real authentication. The per-user cap is
+    # checked first, so a single user's excess requests never take queue slots.
+    async def dependency(token: str = Depends(oauth2_scheme)):
+        login = decode_token_login(token)
+        if login is None:
+            raise HTTPException(
+                status_code=status.HTTP_401_UNAUTHORIZED,
+                detail="Could not validate credentials",
+                headers={"WWW-Authenticate": "Bearer"},
+            )
+        user_limiter = get_user_limiters()[route_class]
+        limiter = get_route_limiters()[route_class]
+        user_limiter.acquire(login)
+        try:
+            await limiter.acquire()
+            try:
+                yield
+            finally:
+                limiter.release()
+        finally:
+            user_limiter.release(login)
+
+    return dependency
+
+
+UPLOAD_PATH = re.compile(r"^/books/[^/]+/file$")
+
+
+class UploadAdmissionMiddleware:
+    """Applies transfer admission control to uploads before the body is received.
+
+    FastAPI parses multipart bodies before it resolves route dependencies, so a
+    dependency would only limit the S3 push, not the receive itself.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] != "PUT" or not UPLOAD_PATH.match(scope["path"]):
+            await self.app(scope, receive, send)
+            return
+
+        # Requests without a valid token are still class-limited; the route
+        # rejects them with 401 before touching the body.
+        authorization = Headers(scope=scope).get("authorization", "")
+        scheme, _, token = authorization.partition(" ")
+        login = decode_token_login(token) if scheme.lower() == "bearer" else None
+
+        user_limiter = get_user_limiters()[TRANSFER]
+        limiter = get_route_limiters()[TRANSFER]
+        try:
+            if login is not None:
+                user_limiter.acquire(login)
+        except HTTPException as e:
+            await self.reject(e, scope, receive, send)
+            return
+        try:
+            try:
+                await limiter.acquire()
+            except HTTPException as e:
+                await self.reject(e, scope, receive, send)
+                return
+            try:
+                await self.app(scope, receive, send)
+            finally:
+                limiter.release()
+        finally:
+            if login is not None:
+                user_limiter.release(login)
+
+    async def reject(self, exc: HTTPException, scope, receive, send):
+        response = JSONResponse({"detail": exc.detail}, status_code=exc.status_code, headers=exc.headers)
+        await response(scope, receive, send)
+
+
+def admission_stats() -> dict:
+    return {
+        "pid": os.getpid(),
+        "route_classes": {name: limiter.stats() for name, limiter in get_route_limiters().items()},
+        "users": {name: limiter.stats() for name, limiter in get_user_limiters().items()},
+    }
+
+
+# Counters live in each uvicorn worker, but a scrape reaches only one of them.
+# Every worker therefore publishes a snapshot to a shared directory, and the
+# metrics endpoint merges the snapshots of all live workers.
+
+def stats_path(pid: int) -> str:
+    return os.path.join(get_settings().admission_stats_dir, f"{pid}.json")
+
+
+def write_admission_stats():
+    path = stats_path(os.getpid())
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(admission_stats(), f)
+    os.replace(tmp_path, path)
+
+
+async def publish_admission_stats():
+    interval = get_settings().admission_stats_interval
+    while True:
+        try:
+            write_admission_stats()
+        except OSError:
+            logger.exception("Could not publish admission stats")
+        await asyncio.sleep(interval)
+
+
+def merge_counters(total: dict, stats: dict):
+    for name, value in stats.items():
+        if name == "max_queued":
+            total[name] = max(total.get(name, 0), value)
+        else:
+            total[name] = total.get(name, 0) + value
+
+
+def collect_admission_stats() -> dict:
+    settings = get_settings()
+    # Snapshots that stopped updating belong to workers that have exited.
+    fresh_after = time.time() - 3 * settings.admission_stats_interval
+    # Refresh this worker's snapshot so the scraped worker is never stale.
+    write_admission_stats()
+    workers = []
+    for entry in os.scandir(settings.admission_stats_dir):
+        if not entry.name.endswith(".json"):
+            continue
+        try:
+            if entry.stat().st_mtime < fresh_after:
+                continue
+            with open(entry.path) as f:
+                workers.append(json.load(f))
+        except (OSError, ValueError):
+            continue
+
+    total = {"route_classes": {}, "users": {}}
+    for worker in workers:
+        for section in ("route_classes", "users"):
+            for name, stats in worker[section].items():
+                merge_counters(total[section].setdefault(name, {}), stats)
+    return {"workers": workers, "total": total}
+
+
+admission_stats_task: asyncio.Task | None = None
+
+
+def start_admission_stats():
+    global admission_stats_task
+    admission_stats_task = asyncio.create_task(publish_admission_stats())
+
+
+async def stop_admission_stats():
+    global admission_stats_task
+    if admission_stats_task is not None:
+        admission_stats_task.cancel()
+        await asyncio.gather(admission_stats_task, return_exceptions=True)
+        admission_stats_task = None
+    try:
+        os.remove(stats_path(os.getpid()))
+    except OSError:
+        pass
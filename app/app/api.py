@@ -1,5 +1,6 @@
-from fastapi import APIRouter, Depends, HTTPException, status, Form, UploadFile, File
-from fastapi.responses import StreamingResponse
+from fastapi import APIRouter, Depends, HTTPException, status, Form, UploadFile, File, Request, Header
+from fastapi.responses import Response, StreamingResponse
+from starlette.concurrency import run_in_threadpool
 from app.dependencies import (
     get_users_service,
     get_collections_service,
@@ -13,13 +14,22 @@ from app.schemas import (
 )
 from app.services import UsersService, CollectionsService, BooksService
 from uuid import UUID
+from datetime import datetime, timedelta, timezone
+import secrets
 from app.utils import verify_password, create_access_token, hash_password
 from app.database import get_s3_client
-from app.config import settings
+from app.admission import AUTH, TRANSFER, METADATA, limit_route, limit_user_route, collect_admission_stats
+from app.config import get_settings
 from unidecode import unidecode
+from app.models import PENDING, PROCESSING
+from app.processing import book_file_key, book_cover_key, delete_book_cover, enqueue_book_processing
 
 router = APIRouter()
 
+auth_limits = [Depends(limit_route(AUTH))]
+transfer_limits = [Depends(limit_user_route(TRANSFER))]
+metadata_limits = [Depends(limit_user_route(METADATA))]
+
 def check_ownership(current_user: UserRead, resource_owner: str):
     if current_user.login != resource_owner:
         raise HTTPException(
@@ -27,15 +37,25 @@ def check_ownership(current_user: UserRead, resource_owner: str):
             detail="You don't have permission to access this resource"
         )
 
+def etag_matches(if_none_match: str | None, etag: str) -> bool:
+    # If-None-Match uses weak comparison and may hold a list of tags or "*".
+    if not if_none_match:
+        return False
+    for tag in if_none_match.split(","):
+        tag = tag.strip()
+        if tag == "*" or tag.removeprefix("W/") == etag:
+            return True
+    return False
+
 
 # Auth Endpoints
-@router.post("/auth/token")
+@router.post("/auth/token", dependencies=auth_limits)
 async def login_for_access_token(
     user_data: UserCreate,
     service: UsersService = Depends(get_users_service)
 ):
     user = await service.get_user(user_data.login)
-    if not user or not verify_password(user_data.password, user.hashed_password):
+    if not user or not await run_in_threadpool(verify_password, user_data.password, user.hashed_password):
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect login or password"
@@ -43,14 +63,14 @@ async def login_for_access_token(
     access_token = create_access_token(data={"sub": user.login})
     return {"access_token": access_token, "token_type": "bearer"}
 
-@router.post("/swaggertoken")
+@router.post("/swaggertoken", dependencies=auth_limits)
 async def login_for_swagger_token(
     username: str = Form(...),
     password: str = Form(...),
     service: UsersService = Depends(get_users_service)
 ):
     user = await service.get_user(username)
-    if not user or not verify_password(password, user.hashed_password):
+    if not user or not await run_in_threadpool(verify_password, password, user.hashed_password):
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect login or password"
@@ -58,13 +78,27 @@ async def login_for_swagger_token(
     access_token = create_access_token(data={"sub": user.login})
     return {"access_token": access_token, "token_type": "bearer"}
 
+# Admission Endpoints
+@router.get("/metrics/admission", include_in_schema=False)
+async def get_admission_stats(x_metrics_token: str | None = Header(default=None)):
+    # Only reachable with the internal METRICS_TOKEN; disabled when it is unset.
+    metrics_token = get_settings().metrics_token
+    if not metrics_token or not x_metrics_token or not secrets.compare_digest(x_metrics_token, metrics_token):
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Not Found")
+    return collect_admission_stats()
+
 # User Endpoints
-@router.post("/users/", response_model=UserRead, status_code=status.HTTP_201_CREATED)
+@router.post(
+    "/users/",
+    response_model=UserRead,
+    status_code=status.HTTP_201_CREATED,
+    dependencies=auth_limits
+)
 async def create_user(
     user_data: UserCreate,
     service: UsersService = Depends(get_users_service)
 ):
-    hashed_password = hash_password(user_data.password)
+    hashed_password = await run_in_threadpool(hash_password, user_data.password)
     user = await service.create_user(user_data.login, hashed_password)
     if not user:
         raise HTTPException(
@@ -74,7 +108,7 @@ async def create_user(
     await service.session.commit()
     return user
 
-@router.get("/users/{login}", response_model=UserRead)
+@router.get("/users/{login}", response_model=UserRead, dependencies=metadata_limits)
 async def get_user(
     login: str,
     service: UsersService = Depends(get_users_service),
@@ -89,7 +123,7 @@ async def get_user(
         )
     return user
 
-@router.delete("/users/{login}", status_code=status.HTTP_204_NO_CONTENT)
+@router.delete("/users/{login}", status_code=status.HTTP_204_NO_CONTENT, dependencies=metadata_limits)
 async def delete_user(
     login: str,
     service: UsersService = Depends(get_users_service),
@@ -108,7 +142,8 @@ async def delete_user(
 @router.post(
     "/users/{user_login}/collections/",
     response_model=CollectionRead,
-    status_code=status.HTTP_201_CREATED
+    status_code=status.HTTP_201_CREATED,
+    dependencies=metadata_limits
 )
 async def create_collection(
     user_login: str,
@@ -129,7 +164,7 @@ async def create_collection(
     await service.session.commit()
     return collection
 
-@router.get("/collections/{uuid}", response_model=CollectionReadWithBooks)
+@router.get("/collections/{uuid}", response_model=CollectionReadWithBooks, dependencies=metadata_limits)
 async def get_collection(
     uuid: UUID,
     service: CollectionsService = Depends(get_collections_service),
@@ -144,7 +179,7 @@ async def get_collection(
     check_ownership(current_user, collection.user_login)
     return collection
 
-@router.get("/users/{user_login}/collections/", response_model=list[CollectionRead])
+@router.get("/users/{user_login}/collections/", response_model=list[CollectionRead], dependencies=metadata_limits)
 async def get_user_collections(
     user_login: str,
     service: CollectionsService = Depends(get_collections_service),
@@ -154,7 +189,7 @@ async def get_user_collections(
     collections = await service.get_user_collections(user_login)
     return collections
 
-@router.delete("/collections/{uuid}", status_code=status.HTTP_204_NO_CONTENT)
+@router.delete("/collections/{uuid}", status_code=status.HTTP_204_NO_CONTENT, dependencies=metadata_limits)
 async def delete_collection(
     uuid: UUID,
     service: CollectionsService = Depends(get_collections_service),
@@ -174,7 +209,8 @@ async def delete_collection(
 @router.post(
     "/collections/{collection_uuid}/books/",
     response_model=BookRead,
-    status_code=status.HTTP_201_CREATED
+    status_code=status.HTTP_201_CREATED,
+    dependencies=metadata_limits
 )
 async def create_book(
     collection_uuid: UUID,
@@ -201,6 +237,7 @@ async def create_book(
     return book
 
 
+# Transfer admission for uploads is done by UploadAdmissionMiddleware.
 @router.put("/books/{book_uuid}/file", response_model=BookRead)
 async def upload_book_file(
     book_uuid: UUID,
@@ -219,19 +256,26 @@ async def upload_book_file(
     try:
         filename_ascii = unidecode(file.filename)
         
-        file_key = f"books/{book.uuid}"
+        file_key = book_file_key(book.uuid)
         async with get_s3_client() as s3:
             await s3.upload_fileobj(
                 Fileobj=file.file,
-                Bucket=settings.bucket_name,
+                Bucket=get_settings().bucket_name,
                 Key=file_key
             )
 
+        old_cover_hash = book.cover_hash
         updated_book = await books_service.update_file_name(
             book_uuid=book.uuid,
-            file_name=filename_ascii
+            file_name=filename_ascii,
+            processing_status=PENDING
         )
         await books_service.session.commit()
+        # Delete the old cover before enqueueing, so a new cover with the
+        # same content hash cannot be deleted right after it is written.
+        if old_cover_hash:
+            await delete_book_cover(book.uuid, old_cover_hash)
+        enqueue_book_processing(updated_book.uuid, updated_book.file_generation)
         return updated_book
 
     except Exception as e:
@@ -241,7 +285,7 @@ async def upload_book_file(
             detail=f"Error uploading file: {str(e)}"
         )
 
-@router.get("/books/{book_uuid}/file")
+@router.get("/books/{book_uuid}/file", dependencies=transfer_limits)
 async def download_book_file(
     book_uuid: UUID,
     collections_service: CollectionsService = Depends(get_collections_service),
@@ -256,10 +300,10 @@ async def download_book_file(
     check_ownership(current_user, collection.user_login)
 
     try:
-        file_key = f"books/{book.uuid}"
+        file_key = book_file_key(book.uuid)
         async with get_s3_client() as s3:
             obj = await s3.get_object(
-                Bucket=settings.bucket_name,
+                Bucket=get_settings().bucket_name,
                 Key=file_key
             )
             data = await obj["Body"].read()
@@ -275,7 +319,76 @@ async def download_book_file(
             detail=f"File download error: {str(e)}"
         )
 
-@router.get("/books/{uuid}", response_model=BookRead)
+@router.get("/books/{book_uuid}/cover", dependencies=metadata_limits)
+async def get_book_cover(
+    book_uuid: UUID,
+    request: Request,
+    collections_service: CollectionsService = Depends(get_collections_service),
+    books_service: BooksService = Depends(get_books_service),
+    current_user: UserRead = Depends(get_current_user),
+):
+    book = await books_service.get_book(book_uuid)
+    if not book or not book.has_cover:
+        raise HTTPException(status_code=404, detail="Cover not found")
+
+    collection = await collections_service.get_collection(book.collection_uuid)
+    check_ownership(current_user, collection.user_login)
+
+    headers = {
+        "ETag": f'"{book.cover_hash}"',
+        "Cache-Control": "private, max-age=3600",
+        "X-Content-Type-Options": "nosniff"
+    }
+    if etag_matches(request.headers.get("if-none-match"), headers["ETag"]):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+    try:
+        async with get_s3_client() as s3:
+            obj = await s3.get_object(
+                Bucket=get_settings().bucket_name,
+                Key=book_cover_key(book.uuid, book.cover_hash)
+            )
+            data = await obj["Body"].read()
+
+        return Response(content=data, media_type=book.cover_media_type, headers=headers)
+    except Exception as e:
+        raise HTTPException(
+            status_code=500,
+            detail=f"Cover download error: {str(e)}"
+        )
+
+@router.post(
+    "/books/{book_uuid}/file/processing",
+    response_model=BookRead,
+    status_code=status.HTTP_202_ACCEPTED,
+    dependencies=metadata_limits
+)
+async def retry_book_processing(
+    book_uuid: UUID,
+    collections_service: CollectionsService = Depends(get_collections_service),
+    books_service: BooksService = Depends(get_books_service),
+    current_user: UserRead = Depends(get_current_user),
+):
+    book = await books_service.get_book(book_uuid)
+    if not book or not book.file_name:
+        raise HTTPException(status_code=404, detail="File not found")
+
+    collection = await collections_service.get_collection(book.collection_uuid)
+    check_ownership(current_user, collection.user_login)
+
+    stale_before = datetime.now(timezone.utc) - timedelta(seconds=get_settings().book_processing_timeout)
+    if book.processing_status == PROCESSING and book.processing_claimed_at and book.processing_claimed_at > stale_before:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="File is already being processed"
+        )
+
+    updated_book = await books_service.update_processing_status(book.uuid, PENDING, book.file_generation)
+    await books_service.session.commit()
+    enqueue_book_processing(updated_book.uuid, updated_book.file_generation)
+    return updated_book
+
+@router.get("/books/{uuid}", response_model=BookRead, dependencies=metadata_limits)
 async def get_book(
     uuid: UUID,
     collections_service: CollectionsService = Depends(get_collections_service),
@@ -293,7 +406,7 @@ async def get_book(
     check_ownership(current_user, collection.user_login)
     return book
 
-@router.get("/collections/{collection_uuid}/books/", response_model=list[BookRead])
+@router.get("/collections/{collection_uuid}/books/", response_model=list[BookRead], dependencies=metadata_limits)
 async def get_collection_books(
     collection_uuid: UUID,
     collections_service: CollectionsService = Depends(get_collections_service),
@@ -309,7 +422,7 @@ async def get_collection_books(
     books = await books_service.get_collection_books(collection_uuid)
     return books
 
-@router.put("/books/{uuid}", response_model=BookRead)
+@router.put("/books/{uuid}", response_model=BookRead, dependencies=metadata_limits)
 async def update_book(
     uuid: UUID,
     book_data: BookCreate,
@@ -337,7 +450,7 @@ async def update_book(
     return updated_book
 
 
-@router.delete("/books/{uuid}", status_code=status.HTTP_204_NO_CONTENT)
+@router.delete("/books/{uuid}", status_code=status.HTTP_204_NO_CONTENT, dependencies=metadata_limits)
 async def delete_book(
     uuid: UUID,
     collections_service: CollectionsService = Depends(get_collections_service),
@@ -354,15 +467,20 @@ async def delete_book(
     collection = await collections_service.get_collection(book.collection_uuid)
     check_ownership(current_user, collection.user_login)
 
-    file_key = f"books/{book.uuid}"
+    file_key = book_file_key(book.uuid)
 
     try:
         async with get_s3_client() as s3:
             if book.file_name:
                 await s3.delete_object(
-                    Bucket=settings.bucket_name,
+                    Bucket=get_settings().bucket_name,
                     Key=file_key
                 )
+            if book.has_cover:
+                await s3.delete_object(
+                    Bucket=get_settings().bucket_name,
+                    Key=book_cover_key(book.uuid, book.cover_hash)
+                )
     except Exception as e:
         pass
 
@@ -1,3 +1,6 @@
+import os
+import tempfile
+from functools import lru_cache
 from pydantic_settings import BaseSettings
 
 class Settings(BaseSettings):
@@ -10,9 +13,28 @@ class Settings(BaseSettings):
     bucket_name: str
     endpoint_url: str
     region: str
+    auth_max_concurrency: int = 4
+    auth_max_queue: int = 8
+    transfer_max_concurrency: int = 8
+    transfer_max_queue: int = 8
+    metadata_max_concurrency: int = 64
+    metadata_max_queue: int = 128
+    admission_queue_timeout: float = 2.0
+    admission_retry_after: int = 1
+    metrics_token: str | None = None
+    admission_stats_dir: str = os.path.join(tempfile.gettempdir(), "bookvault-admission")
+    admission_stats_interval: float = 1.0
+    transfer_user_max_in_flight: int = 2
+    metadata_user_max_in_flight: int = 16
+    book_processing_workers: int = 1
+    book_processing_timeout: int = 600
+    book_extraction_timeout: int = 120
+    cover_max_bytes: int = 2 * 1024 * 1024
 
     class Config:
         env_file = ".env"
         env_file_encoding = "utf-8"
 
-settings = Settings()
+@lru_cache
+def get_settings() -> Settings:
+    return Settings()
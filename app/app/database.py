@@ -1,27 +1,42 @@
-from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession, async_sessionmaker
-from aiobotocore.config import AioConfig
-from aioboto3 import Session
-from app.config import settings
+from functools import lru_cache
+from sqlalchemy.ext.asyncio import create_async_engine, AsyncEngine, AsyncSession, async_sessionmaker
+from app.config import get_settings
 
-config = AioConfig(
-    request_checksum_calculation='WHEN_REQUIRED',
-    response_checksum_validation='WHEN_REQUIRED'
-)
+# The engine and the S3 session are created on first use (or in the app
+# lifespan) so that importing the app does not pull in asyncpg or botocore.
 
-engine = create_async_engine(settings.database_url)
-async_session = async_sessionmaker(engine, expire_on_commit=False)
+@lru_cache
+def get_engine() -> AsyncEngine:
+    return create_async_engine(get_settings().database_url)
+
+@lru_cache
+def get_sessionmaker() -> async_sessionmaker[AsyncSession]:
+    return async_sessionmaker(get_engine(), expire_on_commit=False)
 
 async def get_db() -> AsyncSession:
-    async with async_session() as session:
+    async with get_sessionmaker()() as session:
         yield session
 
+@lru_cache
+def get_s3_session():
+    from aioboto3 import Session
+    return Session()
+
+@lru_cache
+def get_s3_config():
+    from aiobotocore.config import AioConfig
+    return AioConfig(
+        request_checksum_calculation='WHEN_REQUIRED',
+        response_checksum_validation='WHEN_REQUIRED'
+    )
+
 def get_s3_client():
-    session = Session()
-    return session.client(
+    settings = get_settings()
+    return get_s3_session().client(
         "s3",
         endpoint_url=settings.endpoint_url,
         aws_access_key_id=settings.aws_access_key_id,
         aws_secret_access_key=settings.aws_secret_access_key,
         region_name=settings.region,
-        config=config,
+        config=get_s3_config(),
     )
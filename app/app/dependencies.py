@@ -1,15 +1,11 @@
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
-from jose import JWTError, jwt
+import jwt
 from app.services import UsersService, CollectionsService, BooksService
 from app.schemas import UserRead
 from sqlalchemy.ext.asyncio import AsyncSession
 from app.database import get_db
-from app.config import settings
-
-SECRET_KEY = settings.secret_key
-ALGORITHM = settings.algorithm
-ACCESS_TOKEN_EXPIRE_MINUTES = settings.access_token_expire_minutes
+from app.config import get_settings
 
 async def get_users_service(db: AsyncSession = Depends(get_db)) -> UsersService:
     return UsersService(db)
@@ -22,6 +18,14 @@ async def get_books_service(db: AsyncSession = Depends(get_db)) -> BooksService:
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/swaggertoken")
 
+def decode_token_login(token: str) -> str | None:
+    settings = get_settings()
+    try:
+        payload = jwt.decode(token, settings.secret_key, algorithms=[settings.algorithm])
+    except jwt.PyJWTError:
+        return None
+    return payload.get("sub")
+
 async def get_current_user(
     token: str = Depends(oauth2_scheme),
     service: UsersService = Depends(get_users_service)
@@ -31,12 +35,8 @@ async def get_current_user(
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
-    try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        login: str = payload.get("sub")
-        if login is None:
-            raise credentials_exception
-    except JWTError:
+    login = decode_token_login(token)
+    if login is None:
         raise credentials_exception
     user = await service.get_user(login)
     if user is None:
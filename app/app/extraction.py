@@ -0,0 +1,187 @@
+"""Book file metadata and cover extraction.
+
+Runs in the book processing worker pool, so this module only imports the
+standard library at module level; pypdf is loaded on demand.
+"""
+import hashlib
+import os
+import posixpath
+import zipfile
+from dataclasses import dataclass
+from urllib.parse import unquote
+from xml.etree import ElementTree
+
+EPUB = "epub"
+PDF = "pdf"
+UNKNOWN = "unknown"
+
+CONTAINER_NS = {"c": "urn:oasis:names:tc:opendocument:xmlns:container"}
+OPF_NS = {"opf": "http://www.idpf.org/2007/opf", "dc": "http://purl.org/dc/elements/1.1/"}
+
+# Upper bound for container.xml and the OPF package document.
+XML_MAX_BYTES = 1024 * 1024
+
+IMAGE_MEDIA_TYPES = {
+    ".jpg": "image/jpeg",
+    ".jpeg": "image/jpeg",
+    ".png": "image/png",
+    ".gif": "image/gif",
+    ".webp": "image/webp",
+}
+# Only raster formats are served as covers; SVG could carry scripts.
+COVER_MEDIA_TYPES = set(IMAGE_MEDIA_TYPES.values())
+
+
+@dataclass
+class BookFileMetadata:
+    file_size: int
+    file_format: str
+    page_count: int | None = None
+    title: str | None = None
+    author: str | None = None
+    cover: bytes | None = None
+    cover_media_type: str | None = None
+
+    @property
+    def cover_hash(self) -> str | None:
+        if self.cover is None:
+            return None
+        return hashlib.sha1(self.cover).hexdigest()
+
+
+def detect_format(path: str, file_name: str) -> str:
+    with open(path, "rb") as f:
+        head = f.read(5)
+    if head.startswith(b"%PDF"):
+        return PDF
+    if head.startswith(b"PK") and zipfile.is_zipfile(path):
+        try:
+            with zipfile.ZipFile(path) as archive:
+                if "META-INF/container.xml" in archive.namelist():
+                    return EPUB
+        except zipfile.BadZipFile:
+            pass
+    extension = os.path.splitext(file_name)[1].lower().lstrip(".")
+    return extension[:32] or UNKNOWN
+
+
+def extract_book_metadata(path: str, file_name: str, cover_max_bytes: int) -> BookFileMetadata:
+    metadata = BookFileMetadata(
+        file_size=os.path.getsize(path),
+        file_format=detect_format(path, file_name)
+    )
+    if metadata.file_format == EPUB:
+        extract_epub(path, metadata, cover_max_bytes)
+    elif metadata.file_format == PDF:
+        extract_pdf(path, metadata)
+    if metadata.cover is not None and len(metadata.cover) > cover_max_bytes:
+        metadata.cover = None
+        metadata.cover_media_type = None
+    return metadata
+
+
+def read_member(archive: zipfile.ZipFile, name: str, max_bytes: int) -> bytes | None:
+    # Check the declared size first so oversized members are never decompressed;
+    # zipfile stops reading a member at its declared size.
+    try:
+        info = archive.getinfo(name)
+    except KeyError:
+        return None
+    if info.file_size > max_bytes:
+        return None
+    return archive.read(info)
+
+
+def extract_epub(path: str, metadata: BookFileMetadata, cover_max_bytes: int):
+    # A malformed EPUB still keeps the size and format found so far.
+    try:
+        read_epub(path, metadata, cover_max_bytes)
+    except (zipfile.BadZipFile, ElementTree.ParseError):
+        metadata.cover = None
+        metadata.cover_media_type = None
+
+
+def read_epub(path: str, metadata: BookFileMetadata, cover_max_bytes: int):
+    with zipfile.ZipFile(path) as archive:
+        container_xml = read_member(archive, "META-INF/container.xml", XML_MAX_BYTES)
+        if container_xml is None:
+            return
+        container = ElementTree.fromstring(container_xml)
+        rootfile = container.find("c:rootfiles/c:rootfile", CONTAINER_NS)
+        if rootfile is None or not rootfile.get("full-path"):
+            return
+        opf_path = rootfile.get("full-path")
+        package_xml = read_member(archive, opf_path, XML_MAX_BYTES)
+        if package_xml is None:
+            return
+        package = ElementTree.fromstring(package_xml)
+
+        title = package.find("opf:metadata/dc:title", OPF_NS)
+        author = package.find("opf:metadata/dc:creator", OPF_NS)
+        metadata.title = title.text.strip() if title is not None and title.text else None
+        metadata.author = author.text.strip() if author is not None and author.text else None
+
+        item = find_epub_cover_item(package)
+        if item is None or not item.get("href"):
+            return
+        href = posixpath.normpath(
+            posixpath.join(posixpath.dirname(opf_path), unquote(item.get("href")))
+        )
+        metadata.cover = read_member(archive, href, cover_max_bytes)
+        if metadata.cover is None:
+            return
+        metadata.cover_media_type = item.get("media-type")
+
+
+def find_epub_cover_item(package: ElementTree.Element) -> ElementTree.Element | None:
+    items = package.findall("opf:manifest/opf:item", OPF_NS)
+    images = [item for item in items if item.get("media-type") in COVER_MEDIA_TYPES]
+
+    # EPUB 3 marks the cover in the manifest item properties.
+    for item in images:
+        if "cover-image" in (item.get("properties") or "").split():
+            return item
+
+    # EPUB 2 points to the cover item with <meta name="cover" content="item-id"/>.
+    for meta in package.findall("opf:metadata/opf:meta", OPF_NS):
+        if meta.get("name") == "cover":
+            for item in images:
+                if item.get("id") == meta.get("content"):
+                    return item
+
+    for item in images:
+        if "cover" in (item.get("id") or "").lower() or "cover" in (item.get("href") or "").lower():
+            return item
+    return None
+
+
+def extract_pdf(path: str, metadata: BookFileMetadata):
+    from pypdf import PdfReader
+    from pypdf.errors import PyPdfError
+
+    try:
+        reader = PdfReader(path)
+        metadata.page_count = len(reader.pages)
+        if reader.metadata is not None:
+            metadata.title = reader.metadata.title or None
+            metadata.author = reader.metadata.author or None
+    except PyPdfError:
+        return
+
+    # PDFs have no cover entry; use the first image embedded in the first page.
+    # Image extraction needs Pillow (pypdf[image]); a missing dependency is not
+    # swallowed here so that it fails the job and shows up in the logs.
+    try:
+        images = reader.pages[0].images if metadata.page_count else []
+        for image in images:
+            media_type = image_media_type(image.name)
+            if media_type:
+                metadata.cover = image.data
+                metadata.cover_media_type = media_type
+                break
+    except (PyPdfError, OSError, NotImplementedError):
+        pass
+
+
+def image_media_type(name: str) -> str | None:
+    return IMAGE_MEDIA_TYPES.get(os.path.splitext(name)[1].lower())
@@ -1,7 +1,14 @@
-from sqlalchemy import ForeignKey, String, Text
+from sqlalchemy import BigInteger, DateTime, ForeignKey, Integer, String, Text
 from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column, relationship
+from datetime import datetime
 from uuid import UUID, uuid4
 
+# Book.processing_status values
+PENDING = "pending"
+PROCESSING = "processing"
+READY = "ready"
+FAILED = "failed"
+
 class Base(DeclarativeBase):
     pass
 
@@ -36,8 +43,22 @@ class Book(Base):
     author: Mapped[str] = mapped_column(String(255), nullable=False)
     description: Mapped[str] = mapped_column(Text, nullable=False)
     file_name: Mapped[str | None] = mapped_column(String(255), nullable=True)
+    file_size: Mapped[int | None] = mapped_column(BigInteger, nullable=True)
+    file_format: Mapped[str | None] = mapped_column(String(32), nullable=True)
+    page_count: Mapped[int | None] = mapped_column(Integer, nullable=True)
+    file_title: Mapped[str | None] = mapped_column(String(255), nullable=True)
+    file_author: Mapped[str | None] = mapped_column(String(255), nullable=True)
+    cover_media_type: Mapped[str | None] = mapped_column(String(64), nullable=True)
+    cover_hash: Mapped[str | None] = mapped_column(String(64), nullable=True)
+    processing_status: Mapped[str | None] = mapped_column(String(16), nullable=True)
+    processing_claimed_at: Mapped[datetime | None] = mapped_column(DateTime(timezone=True), nullable=True)
+    file_generation: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
     collection_uuid: Mapped[UUID] = mapped_column(
         ForeignKey("collections.uuid", ondelete="CASCADE"),
         nullable=False
     )
     collection: Mapped["Collection"] = relationship(back_populates="books")
+
+    @property
+    def has_cover(self) -> bool:
+        return self.cover_hash is not None
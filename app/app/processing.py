@@ -0,0 +1,242 @@
+import asyncio
+import logging
+import multiprocessing
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime, timedelta, timezone
+from uuid import UUID
+from app.config import get_settings
+from app.database import get_sessionmaker, get_s3_client
+from app.extraction import extract_book_metadata
+from app.models import PENDING, READY, FAILED
+from app.services import BooksService
+
+logger = logging.getLogger(__name__)
+
+# A job whose extraction kills the pool is retried once before it is failed.
+MAX_ATTEMPTS = 2
+
+
+def book_file_key(book_uuid: UUID) -> str:
+    return f"books/{book_uuid}"
+
+
+def book_cover_key(book_uuid: UUID, cover_hash: str) -> str:
+    return f"covers/{book_uuid}/{cover_hash}"
+
+
+class BookProcessor:
+    """Extracts file metadata and covers for uploaded books off the request path.
+
+    Jobs are queued in memory per worker process and claimed in the database
+    before they run, so pending books left behind by a restart can be picked
+    up again on startup by any worker. The CPU-bound parsing runs in a process
+    pool that is only spawned once the first job arrives.
+    """
+
+    def __init__(self, workers: int):
+        self.workers = workers
+        self.queue: asyncio.Queue[tuple[UUID, int, int]] = asyncio.Queue()
+        self.executor = self.create_executor()
+        self.tasks: list[asyncio.Task] = []
+
+    def create_executor(self) -> ProcessPoolExecutor:
+        return ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=multiprocessing.get_context("spawn")
+        )
+
+    def replace_executor(self, executor: ProcessPoolExecutor, kill: bool = False):
+        # Several jobs can see the same broken pool; only replace it once.
+        if self.executor is not executor:
+            return
+        self.executor = self.create_executor()
+        if kill:
+            # ProcessPoolExecutor cannot cancel a running call, so a hung
+            # extraction is stopped by killing the pool's processes.
+            for process in list(executor._processes.values()):
+                process.kill()
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    def start(self):
+        self.tasks = [asyncio.create_task(self.run()) for _ in range(self.workers)]
+        self.tasks.append(asyncio.create_task(self.recover()))
+
+    async def recover(self):
+        # Every worker re-enqueues the same books; the claim in process()
+        # makes sure each one is only processed once.
+        try:
+            async with get_sessionmaker()() as session:
+                books = await BooksService(session).get_books_to_process(self.stale_before())
+        except Exception:
+            logger.exception("Could not load books pending processing")
+            return
+        for book_uuid, file_generation in books:
+            self.enqueue(book_uuid, file_generation)
+        if books:
+            logger.info("Re-enqueued %d books pending processing", len(books))
+
+    def stale_before(self) -> datetime:
+        timeout = timedelta(seconds=get_settings().book_processing_timeout)
+        return datetime.now(timezone.utc) - timeout
+
+    async def stop(self):
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+    def enqueue(self, book_uuid: UUID, file_generation: int, attempt: int = 1):
+        self.queue.put_nowait((book_uuid, file_generation, attempt))
+
+    async def run(self):
+        while True:
+            book_uuid, file_generation, attempt = await self.queue.get()
+            try:
+                await self.process(book_uuid, file_generation)
+            except BrokenProcessPool:
+                if attempt >= MAX_ATTEMPTS:
+                    logger.exception("Processing of book %s failed", book_uuid)
+                    await self.set_status(book_uuid, file_generation, FAILED)
+                else:
+                    logger.warning("Extraction pool broke while processing book %s; retrying", book_uuid)
+                    await self.set_status(book_uuid, file_generation, PENDING)
+                    self.enqueue(book_uuid, file_generation, attempt + 1)
+            except Exception:
+                logger.exception("Processing of book %s failed", book_uuid)
+                await self.set_status(book_uuid, file_generation, FAILED)
+            finally:
+                self.queue.task_done()
+
+    async def process(self, book_uuid: UUID, file_generation: int):
+        settings = get_settings()
+        async with get_sessionmaker()() as session:
+            file_name = await BooksService(session).claim_book_processing(
+                book_uuid,
+                file_generation,
+                claimed_at=datetime.now(timezone.utc),
+                stale_before=self.stale_before()
+            )
+            await session.commit()
+        if file_name is None:
+            return
+
+        fd, path = tempfile.mkstemp()
+        f = os.fdopen(fd, "wb")
+        try:
+            async with get_s3_client() as s3:
+                with f:
+                    await s3.download_fileobj(settings.bucket_name, book_file_key(book_uuid), f)
+
+            metadata = await self.extract(path, file_name)
+        finally:
+            f.close()
+            os.remove(path)
+
+        # Covers are keyed by content hash, so a job for a replaced file can
+        # never overwrite the cover the row currently points to.
+        cover_hash = metadata.cover_hash
+        if cover_hash is not None:
+            if not await self.is_current(book_uuid, file_generation):
+                return
+            async with get_s3_client() as s3:
+                await s3.put_object(
+                    Bucket=settings.bucket_name,
+                    Key=book_cover_key(book_uuid, cover_hash),
+                    Body=metadata.cover,
+                    ContentType=metadata.cover_media_type
+                )
+
+        async with get_sessionmaker()() as session:
+            service = BooksService(session)
+            updated_book = await service.update_file_metadata(
+                book_uuid,
+                file_size=metadata.file_size,
+                file_format=metadata.file_format,
+                page_count=metadata.page_count,
+                file_title=metadata.title,
+                file_author=metadata.author,
+                cover_media_type=metadata.cover_media_type,
+                cover_hash=cover_hash,
+                processing_status=READY,
+                file_generation=file_generation
+            )
+            await session.commit()
+
+        if updated_book is None and cover_hash is not None:
+            # The file was replaced or the book deleted while we were working.
+            async with get_sessionmaker()() as session:
+                book = await BooksService(session).get_book(book_uuid)
+            if not book or book.cover_hash != cover_hash:
+                await delete_book_cover(book_uuid, cover_hash)
+
+    async def extract(self, path: str, file_name: str):
+        settings = get_settings()
+        executor = self.executor
+        loop = asyncio.get_running_loop()
+        try:
+            return await asyncio.wait_for(
+                loop.run_in_executor(
+                    executor,
+                    extract_book_metadata,
+                    path,
+                    file_name,
+                    settings.cover_max_bytes
+                ),
+                settings.book_extraction_timeout
+            )
+        except asyncio.TimeoutError:
+            self.replace_executor(executor, kill=True)
+            raise
+        except BrokenProcessPool:
+            self.replace_executor(executor)
+            raise
+
+    async def is_current(self, book_uuid: UUID, file_generation: int) -> bool:
+        async with get_sessionmaker()() as session:
+            book = await BooksService(session).get_book(book_uuid)
+            return book is not None and book.file_generation == file_generation
+
+    async def set_status(self, book_uuid: UUID, file_generation: int, processing_status: str):
+        try:
+            async with get_sessionmaker()() as session:
+                await BooksService(session).update_processing_status(book_uuid, processing_status, file_generation)
+                await session.commit()
+        except Exception:
+            logger.exception("Could not update processing status of book %s", book_uuid)
+
+
+async def delete_book_cover(book_uuid: UUID, cover_hash: str):
+    try:
+        async with get_s3_client() as s3:
+            await s3.delete_object(
+                Bucket=get_settings().bucket_name,
+                Key=book_cover_key(book_uuid, cover_hash)
+            )
+    except Exception:
+        logger.exception("Could not delete cover %s of book %s", cover_hash, book_uuid)
+
+
+book_processor: BookProcessor | None = None
+
+
+def start_book_processing():
+    global book_processor
+    book_processor = BookProcessor(get_settings().book_processing_workers)
+    book_processor.start()
+
+
+async def stop_book_processing():
+    global book_processor
+    if book_processor is not None:
+        await book_processor.stop()
+        book_processor = None
+
+
+def enqueue_book_processing(book_uuid: UUID, file_generation: int):
+    if book_processor is None:
+        logger.warning("Book processing is not running; book %s stays pending until restart", book_uuid)
+        return
+    book_processor.enqueue(book_uuid, file_generation)
@@ -36,6 +36,13 @@ class BookRead(BaseModel):
     author: str
     description: str
     file_name: str | None
+    file_size: int | None = None
+    file_format: str | None = None
+    page_count: int | None = None
+    file_title: str | None = None
+    file_author: str | None = None
+    has_cover: bool = False
+    processing_status: str | None = None
     collection_uuid: UUID
     model_config = ConfigDict(from_attributes=True)
 
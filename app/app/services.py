@@ -1,8 +1,9 @@
-from sqlalchemy import select
+from sqlalchemy import and_, or_, select, update
 from sqlalchemy.orm import selectinload
 from sqlalchemy.ext.asyncio import AsyncSession
 from typing import Optional, List
-from app.models import Collection, Book, User
+from datetime import datetime
+from app.models import Collection, Book, User, PENDING, PROCESSING
 from uuid import UUID
 
 class UsersService:
@@ -112,10 +113,98 @@ class BooksService:
         )
         return result.scalars().all()
 
-    async def update_file_name(self, book_uuid: UUID, file_name: str) -> Book:
-        book = await self.session.get(Book, book_uuid)
+    async def update_file_name(self, book_uuid: UUID, file_name: str, processing_status: Optional[str] = None) -> Book:
+        book = await self.session.get(Book, book_uuid, with_for_update=True, populate_existing=True)
         if not book:
             return None
         book.file_name = file_name
+        book.file_generation += 1
+        book.file_size = None
+        book.file_format = None
+        book.page_count = None
+        book.file_title = None
+        book.file_author = None
+        book.cover_media_type = None
+        book.cover_hash = None
+        book.processing_status = processing_status
         await self.session.flush()
         return book
+
+    async def update_file_metadata(
+        self,
+        book_uuid: UUID,
+        file_size: int,
+        file_format: str,
+        page_count: Optional[int],
+        file_title: Optional[str],
+        file_author: Optional[str],
+        cover_media_type: Optional[str],
+        cover_hash: Optional[str],
+        processing_status: str,
+        file_generation: int
+    ) -> Optional[Book]:
+        book = await self.session.get(Book, book_uuid, with_for_update=True, populate_existing=True)
+        if not book or book.file_generation != file_generation:
+            return None
+        book.file_size = file_size
+        book.file_format = file_format
+        book.page_count = page_count
+        book.file_title = file_title[:255] if file_title else None
+        book.file_author = file_author[:255] if file_author else None
+        book.cover_media_type = cover_media_type
+        book.cover_hash = cover_hash
+        book.processing_status = processing_status
+        await self.session.flush()
+        return book
+
+    async def update_processing_status(self, book_uuid: UUID, processing_status: str, file_generation: int) -> Optional[Book]:
+        book = await self.session.get(Book, book_uuid, with_for_update=True, populate_existing=True)
+        if not book or book.file_generation != file_generation:
+            return None
+        book.processing_status = processing_status
+        await self.session.flush()
+        return book
+
+    async def claim_book_processing(
+        self,
+        book_uuid: UUID,
+        file_generation: int,
+        claimed_at: datetime,
+        stale_before: datetime
+    ) -> Optional[str]:
+        # Atomically takes a pending (or abandoned) job so that only one worker
+        # process handles it. Returns the file name of the claimed book.
+        result = await self.session.execute(
+            update(Book)
+            .where(
+                Book.uuid == book_uuid,
+                Book.file_generation == file_generation,
+                Book.file_name.is_not(None),
+                or_(
+                    Book.processing_status == PENDING,
+                    and_(
+                        Book.processing_status == PROCESSING,
+                        Book.processing_claimed_at < stale_before
+                    )
+                )
+            )
+            .values(processing_status=PROCESSING, processing_claimed_at=claimed_at)
+            .returning(Book.file_name)
+            .execution_options(synchronize_session=False)
+        )
+        return result.scalar_one_or_none()
+
+    async def get_books_to_process(self, stale_before: datetime) -> List[tuple[UUID, int]]:
+        result = await self.session.execute(
+            select(Book.uuid, Book.file_generation).where(
+                Book.file_name.is_not(None),
+                or_(
+                    Book.processing_status == PENDING,
+                    and_(
+                        Book.processing_status == PROCESSING,
+                        Book.processing_claimed_at < stale_before
+                    )
+                )
+            )
+        )
+        return [(row.uuid, row.file_generation) for row in result]
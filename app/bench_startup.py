@@ -0,0 +1,52 @@
+"""Measures worker cold start: import time and RSS of `main` in fresh interpreters.
+
+Usage: python bench_startup.py [runs]
+
+Importing `main` must not require a configured environment, so this can run
+without a .env file. The heavy modules listed below should stay unloaded
+until the app lifespan or the first request that needs them.
+"""
+import json
+import statistics
+import subprocess
+import sys
+
+HEAVY_MODULES = ["botocore", "aioboto3", "asyncpg", "passlib", "jose", "pypdf"]
+
+PROBE = """
+import json, resource, sys, time
+start = time.perf_counter()
+import main
+elapsed = time.perf_counter() - start
+print(json.dumps({
+    "import_ms": elapsed * 1000,
+    "maxrss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    "modules": len(sys.modules),
+    "heavy_loaded": [name for name in %r if name in sys.modules],
+}))
+""" % (HEAVY_MODULES,)
+
+
+def run_once() -> dict:
+    output = subprocess.run(
+        [sys.executable, "-c", PROBE],
+        check=True,
+        capture_output=True,
+        text=True,
+    ).stdout
+    return json.loads(output)
+
+
+def main(runs: int):
+    results = [run_once() for _ in range(runs)]
+    import_ms = [r["import_ms"] for r in results]
+    maxrss_kb = [r["maxrss_kb"] for r in results]
+    print(f"runs:          {runs}")
+    print(f"import median: {statistics.median(import_ms):.1f} ms (min {min(import_ms):.1f}, max {max(import_ms):.1f})")
+    print(f"maxrss median: {statistics.median(maxrss_kb) / 1024:.1f} MiB")
+    print(f"modules:       {results[-1]['modules']}")
+    print(f"heavy loaded:  {', '.join(results[-1]['heavy_loaded']) or 'none'}")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 10)
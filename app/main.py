@@ -1,7 +1,22 @@
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
-import uvicorn
 from app.api import router
+from app.admission import UploadAdmissionMiddleware, start_admission_stats, stop_admission_stats
+from app.database import get_engine
+from app.processing import start_book_processing, stop_book_processing
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    engine = get_engine()
+    start_book_processing()
+    start_admission_stats()
+    yield
+    await stop_admission_stats()
+    await stop_book_processing()
+    await engine.dispose()
+
+app = FastAPI(lifespan=lifespan)
+
+app.add_middleware(UploadAdmissionMiddleware)
 
 app.include_router(router)
@@ -19,6 +19,16 @@ CREATE TABLE books (
     author VARCHAR(255) NOT NULL,
     description TEXT NOT NULL,
     file_name VARCHAR(255),
+    file_size BIGINT,
+    file_format VARCHAR(32),
+    page_count INTEGER,
+    file_title VARCHAR(255),
+    file_author VARCHAR(255),
+    cover_media_type VARCHAR(64),
+    cover_hash VARCHAR(64),
+    processing_status VARCHAR(16),
+    processing_claimed_at TIMESTAMP WITH TIME ZONE,
+    file_generation INTEGER NOT NULL DEFAULT 0,
     collection_uuid UUID NOT NULL,
 
     FOREIGN KEY (collection_uuid) 
@@ -0,0 +1,17 @@
+-- Adds the book file metadata columns to an existing database.
+-- Safe to run more than once.
+
+ALTER TABLE books ADD COLUMN IF NOT EXISTS file_size BIGINT;
+ALTER TABLE books ADD COLUMN IF NOT EXISTS file_format VARCHAR(32);
+ALTER TABLE books ADD COLUMN IF NOT EXISTS page_count INTEGER;
+ALTER TABLE books ADD COLUMN IF NOT EXISTS file_title VARCHAR(255);
+ALTER TABLE books ADD COLUMN IF NOT EXISTS file_author VARCHAR(255);
+ALTER TABLE books ADD COLUMN IF NOT EXISTS cover_media_type VARCHAR(64);
+ALTER TABLE books ADD COLUMN IF NOT EXISTS cover_hash VARCHAR(64);
+ALTER TABLE books ADD COLUMN IF NOT EXISTS processing_status VARCHAR(16);
+ALTER TABLE books ADD COLUMN IF NOT EXISTS processing_claimed_at TIMESTAMP WITH TIME ZONE;
+ALTER TABLE books ADD COLUMN IF NOT EXISTS file_generation INTEGER NOT NULL DEFAULT 0;
+
+-- Queue books uploaded before this migration for metadata extraction.
+UPDATE books SET processing_status = 'pending'
+WHERE file_name IS NOT NULL AND processing_status IS NULL;